@@ -171,6 +171,13 @@ def create_parser():
         '-r', '--recursive', action='store_true',
         help='show dependencies recursively (possible duplicates)')
 
+    # compile
+    subparser = subparsers.add_parser(
+        name='compile',
+        description=('Compile the environment description to a Python '
+                     'sibling file for faster loading'),
+        help='compile the environment description for faster loading')
+
     # complete
     subparser = subparsers.add_parser(
         name='complete',
@@ -229,6 +236,13 @@ load_config_from_file = loader.load
 
 def main(args=None, config=None):
     options = create_parser().parse_args(args)
+    if options.command == 'compile':
+        try:
+            print('Wrote {}.'.format(loader.compile_config(options.file)))
+            return 0
+        except exceptions.MaestroException as e:
+            sys.stderr.write('{}: {}\n'.format(termoutput.red('ERROR'), e))
+            return 1
     if config is None:
         config = loader.load(options.file)
     return execute(options, config)
@@ -49,7 +49,7 @@ class BaseAuditor(object):
     def _format_what(self, what):
         if isinstance(what, entities.Entity):
             return what.name
-        return ', '.join(map(lambda e: e.name, what))
+        return ', '.join(e.name for e in what)
 
     def _format_what_compact(self, what):
         if self._fits_compact(what):
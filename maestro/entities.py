@@ -56,6 +56,9 @@ class Entity:
         """Get the name of this entity."""
         return self._name
 
+    def __lt__(self, other):
+        return self._name < other._name
+
     def __repr__(self):
         return self._name
 
@@ -250,6 +253,8 @@ class Service(Entity):
         self._requires = set([])
         self._wants_info = set([])
         self._needed_for = set([])
+        self._requires_closure = None
+        self._needed_for_closure = None
         self._containers = {}
 
     @property
@@ -284,6 +289,8 @@ class Service(Entity):
     def requires(self):
         """Returns the full set of direct and indirect dependencies of this
         service."""
+        if self._requires_closure is not None:
+            return self._requires_closure
         dependencies = self._requires
         for dep in dependencies:
             dependencies = dependencies.union(dep.requires)
@@ -299,6 +306,8 @@ class Service(Entity):
     def needed_for(self):
         """Returns the full set of direct and indirect dependents (aka services
         that depend on this service)."""
+        if self._needed_for_closure is not None:
+            return self._needed_for_closure
         dependents = self._needed_for
         for dep in dependents:
             dependents = dependents.union(dep.needed_for)
@@ -308,8 +317,7 @@ class Service(Entity):
     def containers(self):
         """Return an ordered list of instance containers for this service, by
         instance name."""
-        return map(lambda c: self._containers[c],
-                   sorted(self._containers.keys()))
+        return [self._containers[c] for c in sorted(self._containers.keys())]
 
     def add_dependency(self, service):
         """Declare that this service depends on the passed service."""
@@ -324,6 +332,22 @@ class Service(Entity):
         via link environment variables."""
         self._wants_info.add(service)
 
+    def freeze(self):
+        """Freeze the service's dependency sets once the environment is fully
+        wired.
+
+        The direct sets become frozensets and the transitive closures served
+        by the requires/needed_for properties are computed once and cached,
+        instead of being rebuilt on every access. No dependency may be added
+        after this point."""
+        self._requires = frozenset(self._requires)
+        self._wants_info = frozenset(self._wants_info)
+        self._needed_for = frozenset(self._needed_for)
+        requires_closure = frozenset(self.requires)
+        needed_for_closure = frozenset(self.needed_for)
+        self._requires_closure = requires_closure
+        self._needed_for_closure = needed_for_closure
+
     def register_container(self, container):
         """Register a new instance container as part of this service."""
         self._containers[container.name] = container
@@ -364,10 +388,14 @@ class Container(Entity):
         config = config or {}
 
         self._status = None  # The container's status, cached.
+        self._volumes_cache = None  # Declared volume targets, cached.
         self._ship = ships[config['ship']]
         self._service = service
         self._image = config.get('image', service.image)
         self._schema = maestro_schema
+        # Precomputed ordering key; comparing these tuples is cheaper than
+        # attribute lookups in __lt__ when sorting large container sets.
+        self._sort_key = (service.name, name)
 
         # Register this instance container as being part of its parent service.
         self._service.register_container(self)
@@ -616,11 +644,15 @@ class Container(Entity):
 
     def get_volumes(self):
         """Returns all the declared local volume targets within this container.
-        This does not includes volumes from other containers."""
-        volumes = set(self.container_volumes)
-        for volume in self.volumes.values():
-            volumes.add(volume['bind'])
-        return volumes
+        This does not includes volumes from other containers. The volume
+        configuration is immutable after construction, so the set is computed
+        on first use and memoized as a frozenset."""
+        if self._volumes_cache is None:
+            volumes = set(self.container_volumes)
+            for volume in self.volumes.values():
+                volumes.add(volume['bind'])
+            self._volumes_cache = frozenset(volumes)
+        return self._volumes_cache
 
     def get_link_variables(self, add_internal=False):
         """Build and return a dictionary of environment variables providing
@@ -902,9 +934,9 @@ class Container(Entity):
                      'expected list of checks, got {}!')
                     .format(state, type(checks)))
 
-            checkers[state] = list(
-                map(lambda c: (lifecycle.LifecycleHelperFactory
-                               .from_config(self, c)), checks))
+            checkers[state] = [
+                lifecycle.LifecycleHelperFactory.from_config(self, c)
+                for c in checks]
 
         return checkers
 
@@ -942,7 +974,7 @@ class Container(Entity):
         return '{} (on {})'.format(self.name, self.ship.name)
 
     def __lt__(self, other):
-        return self.name < other.name
+        return self._sort_key < other._sort_key
 
     def __eq__(self, other):
         return self.name == other.name
@@ -2,9 +2,14 @@
 #
 # Docker container orchestration utility.
 
+import errno
+import functools
+import importlib.util
 import jinja2
 import os
+import pprint
 import sys
+import types
 import yaml
 from yaml.constructor import ConstructorError, SafeConstructor
 
@@ -16,48 +21,158 @@ class MaestroYamlConstructor(SafeConstructor):
     mappings. Because for some reason PyYAML doesn't do that since 3.x."""
 
     def construct_mapping(self, node, deep=False):
-        if not isinstance(node, yaml.nodes.MappingNode):
-            raise ConstructorError(
-                None, None,
-                "expected a mapping node, but found %s" % node.id,
-                node.start_mark)
-        keys = set([])
-        for key_node, value_node in node.value:
-            key = self.construct_object(key_node, deep=deep)
-            if key in keys:
-                raise ConstructorError(
-                    "while constructing a mapping", node.start_mark,
-                    "found duplicate key (%s)" % key, key_node.start_mark)
-            keys.add(key)
-        return SafeConstructor.construct_mapping(self, node, deep)
-
-
-try:
-    # If possible, load the faster, C-based YAML Parser from _yaml.
-    import _yaml
-
-    class MaestroYamlLoader(_yaml.CParser, MaestroYamlConstructor,
-                            yaml.resolver.Resolver):
-        """A custom YAML Loader that uses the custom MaestroYamlConstructor."""
-
-        def __init__(self, stream):
-            _yaml.CParser.__init__(self, stream)
-            MaestroYamlConstructor.__init__(self)
-            yaml.resolver.Resolver.__init__(self)
-except ImportError:
-    # Fallback to the pure-Python implementation otherise.
-    class MaestroYamlLoader(yaml.reader.Reader, yaml.scanner.Scanner,
-                            yaml.parser.Parser, yaml.composer.Composer,
-                            MaestroYamlConstructor, yaml.resolver.Resolver):
-        """A custom YAML Loader that uses the custom MaestroYamlConstructor."""
-
-        def __init__(self, stream):
-            yaml.reader.Reader.__init__(self, stream)
-            yaml.scanner.Scanner.__init__(self)
-            yaml.parser.Parser.__init__(self)
-            yaml.composer.Composer.__init__(self)
-            MaestroYamlConstructor.__init__(self)
-            yaml.resolver.Resolver.__init__(self)
+        mapping = super().construct_mapping(node, deep)
+        if len(mapping) != len(node.value):
+            # The constructed mapping lost entries to duplicate keys; re-scan
+            # the node to find the offending key for the error message. This
+            # only runs on the error path, keeping the common case to a
+            # single construction pass.
+            keys = set()
+            for key_node, value_node in node.value:
+                key = self.construct_object(key_node, deep=deep)
+                if key in keys:
+                    raise ConstructorError(
+                        "while constructing a mapping", node.start_mark,
+                        "found duplicate key (%s)" % key,
+                        key_node.start_mark)
+                keys.add(key)
+        return mapping
+
+
+# Use the C-based YAML parser from libyaml when PyYAML was built with it;
+# yaml.CSafeLoader already picks the right underlying implementation.
+_BaseLoader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+
+
+class MaestroYamlLoader(MaestroYamlConstructor, _BaseLoader):
+    """A custom YAML Loader that uses the custom MaestroYamlConstructor."""
+
+
+# The loader is read-only: nobody registers additional resolvers or
+# constructors on it after this point. Snapshot its dispatch tables into
+# read-only views owned by this class, so they can never be mutated through
+# (or shared with) other loaders, nor copied per instance. The resolver
+# values stay lists because Resolver.resolve() concatenates them with its
+# list defaults.
+MaestroYamlLoader.yaml_implicit_resolvers = types.MappingProxyType(
+    {k: list(v) for k, v in MaestroYamlLoader.yaml_implicit_resolvers.items()})
+MaestroYamlLoader.yaml_constructors = types.MappingProxyType(
+    dict(MaestroYamlLoader.yaml_constructors))
+MaestroYamlLoader.yaml_multi_constructors = types.MappingProxyType(
+    dict(MaestroYamlLoader.yaml_multi_constructors))
+
+
+class _TemplateStreamReader:
+    """File-like reader over a Jinja2 template stream.
+
+    Exposes the rendered template through a read() method so the YAML parser
+    can consume it incrementally, instead of materializing the whole rendered
+    document as a single string first. Chunks are served as UTF-8 bytes,
+    which libyaml takes as-is without the internal re-encoding pass it needs
+    for str input."""
+
+    def __init__(self, stream):
+        self._chunks = iter(stream)
+        self._buffer = b''
+
+    def read(self, size=-1):
+        while size < 0 or len(self._buffer) < size:
+            try:
+                self._buffer += next(self._chunks).encode('utf-8')
+            except StopIteration:
+                break
+        if size < 0:
+            data, self._buffer = self._buffer, b''
+        else:
+            data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+
+@functools.lru_cache(maxsize=32)
+def _get_env(dirname):
+    """Return the Jinja2 environment for templates in the given directory.
+
+    Environments are expensive to build and carry their own template cache,
+    so they are memoized per directory and shared across load() calls. An
+    on-disk bytecode cache additionally saves template compilation across
+    processes, which matters for repeated maestro invocations. The cache
+    directory is left for Jinja2 to choose: its default is a per-user,
+    mode-0700, ownership-checked directory, which a fixed world-shared path
+    would not be safe to replace (the cache is loaded with marshal and could
+    be planted by another local user)."""
+    return jinja2.Environment(
+        loader=jinja2.FileSystemLoader(dirname),
+        auto_reload=False,
+        bytecode_cache=jinja2.FileSystemBytecodeCache())
+
+
+def _compiled_path(filename):
+    """Return the path of the compiled Python sibling of the given
+    environment description file.
+
+    The suffix is deliberately distinctive: only files written by
+    dump_compiled() should ever match it, so that load() never picks up (and
+    executes) an unrelated Python file that happens to sit next to the
+    environment description."""
+    return os.path.splitext(filename)[0] + '.maestro-compiled.py'
+
+
+def dump_compiled(config, path):
+    """Serialize a loaded configuration to a Python module assigning it to a
+    CONFIG constant, to be read back with load_compiled().
+
+    For deployments where the environment description rarely changes, this
+    lets load() skip the Jinja2 and YAML machinery entirely on startup."""
+    with open(path, 'w') as f:
+        f.write('# Generated by maestro.loader.dump_compiled(); do not '
+                'edit.\n')
+        f.write('CONFIG = {}\n'.format(pprint.pformat(config)))
+
+
+def load_compiled(path):
+    """Load a configuration previously serialized with dump_compiled()."""
+    spec = importlib.util.spec_from_file_location('maestro_compiled_config',
+                                                  path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module.CONFIG
+
+
+def compile_config(filename, filters=None, functions=None):
+    """Parse the given environment description file and write its compiled
+    Python sibling, which subsequent load() calls will use as long as it
+    stays at least as recent as the description file.
+
+    Returns the path of the compiled file."""
+    if filename == '-':
+        raise exceptions.MaestroException(
+            'Cannot compile an environment description read from stdin!')
+    path = _compiled_path(filename)
+    dump_compiled(load(filename, filters=filters, functions=functions), path)
+    return path
+
+
+def _load_one(stream):
+    """Parse a single YAML document from the given stream or string with the
+    Maestro loader.
+
+    Equivalent to yaml.load(stream, Loader=MaestroYamlLoader), minus the
+    library-level loader dispatch that shows up in profiles of small
+    documents."""
+    loader = MaestroYamlLoader(stream)
+    try:
+        return loader.get_single_data()
+    finally:
+        loader.dispose()
+
+
+def _set_maestro_base_dir(config, base_dir):
+    """Record the environment's base directory in the '__maestro' section of
+    the given loaded configuration."""
+    if '__maestro' not in config:
+        config['__maestro'] = {}
+    config['__maestro']['base_dir'] = base_dir
+    return config
 
 
 def load(filename, filters=None, functions=None):
@@ -71,30 +186,57 @@ def load(filename, filters=None, functions=None):
         A python data structure corresponding to the YAML configuration.
     """
     base_dir = os.path.dirname(filename) if filename != '-' else os.getcwd()
-    env = jinja2.Environment(
-        loader=jinja2.FileSystemLoader(base_dir),
-        auto_reload=False,
-        extensions=['jinja2.ext.with_'])
+
+    if filename == '-':
+        # Read raw bytes; decoding only happens if the document actually
+        # needs to go through Jinja2.
+        data = sys.stdin.buffer.read()
+    else:
+        # A compiled sibling at least as recent as the description file
+        # short-circuits templating and parsing altogether. A missing, stale
+        # or broken compiled file is never fatal: fall back to parsing the
+        # description file itself.
+        compiled = _compiled_path(filename)
+        try:
+            if os.path.getmtime(compiled) >= os.path.getmtime(filename):
+                return _set_maestro_base_dir(load_compiled(compiled),
+                                             base_dir)
+        except Exception:
+            pass
+        try:
+            with open(filename, 'rb') as f:
+                data = f.read()
+        except IOError as e:
+            if e.errno == errno.ENOENT:
+                raise exceptions.MaestroException(
+                    f'Environment description file {filename} not found!')
+            raise exceptions.MaestroException(
+                f'Error reading environment description file '
+                f'{filename}: {e}!')
+
+    if b'{{' not in data and b'{%' not in data and b'{#' not in data:
+        # Fast path: the document contains no templating markers at all, so
+        # skip the Jinja2 environment and rendering entirely and parse the
+        # raw document.
+        return _set_maestro_base_dir(_load_one(data), base_dir)
+
+    env = _get_env(base_dir)
     if filters:
         env.filters.update(**filters)
     if functions:
         env.globals.update(**functions)
     try:
-        if filename == '-':
-            template = env.from_string(sys.stdin.read())
-        else:
-            template = env.get_template(os.path.basename(filename))
-    except jinja2.exceptions.TemplateNotFound:
-        raise exceptions.MaestroException(
-            'Environment description file {} not found!'.format(filename))
+        # The document contents were already read for the fast-path check;
+        # compile the template from them directly rather than have the
+        # FileSystemLoader stat and read the file all over again.
+        template = env.from_string(data.decode('utf-8'))
     except Exception as e:
         raise exceptions.MaestroException(
-            'Error reading environment description file {}: {}!'
-            .format(filename, e))
+            f'Error reading environment description file {filename}: {e}!')
 
-    config = yaml.load(template.render(env=os.environ),
-                       Loader=MaestroYamlLoader)
-    if '__maestro' not in config:
-        config['__maestro'] = {}
-    config['__maestro']['base_dir'] = base_dir
-    return config
+    # Hand the template a plain dict snapshot of the environment; os.environ
+    # pays encode/decode wrappers on every variable lookup during rendering.
+    stream = template.stream(env=dict(os.environ))
+    stream.enable_buffering(size=1024)
+    config = _load_one(_TemplateStreamReader(stream))
+    return _set_maestro_base_dir(config, base_dir)
@@ -5,8 +5,13 @@
 
 from __future__ import print_function
 
-import functools
+import bisect
+import collections
 import fnmatch
+import heapq
+import itertools
+import re
+import sys
 
 from . import audit
 from . import entities
@@ -16,7 +21,7 @@ from . import shipproviders
 from . import termoutput
 
 AVAILABLE_MAESTRO_COMMANDS = ['status', 'start', 'stop', 'restart',
-                              'pull', 'clean', 'logs', 'deptree']
+                              'pull', 'clean', 'logs', 'deptree', 'compile']
 
 
 class Conductor:
@@ -77,6 +82,20 @@ class Conductor:
                         maestro_schema=self.schema,
                         maestro_env_base=self.base_dir)
 
+        # Frozen set of all containers, for commands acting on the whole
+        # environment, so no-argument calls don't rematerialize the dict
+        # values on every invocation.
+        self._all_containers = frozenset(self.containers.values())
+
+        # Combined name index for command-line token resolution; containers
+        # are inserted last so they take precedence over a service of the
+        # same name, like the lookup order did before.
+        self._lookup = {}
+        for name, service in self.services.items():
+            self._lookup[name] = ('s', service)
+        for name, container in self.containers.items():
+            self._lookup[name] = ('c', container)
+
         # Resolve dependencies between services.
         for kind, service in self._config.get('services', {}).items():
             for dependency in service.get('requires', []):
@@ -98,16 +117,21 @@ class Conductor:
         dep_link_vars_cache = {}
         for service in self.services.values():
             service_link_vars = service.get_link_variables(True)
+            # Flatten the link variables from all of the service's
+            # dependencies into a single dict, once per service rather than
+            # dependency-by-dependency for each container.
+            dep_link_vars = {}
+            for dependency in service.requires.union(service.wants_info):
+                link_vars = dep_link_vars_cache.get(dependency)
+                if link_vars is None:
+                    link_vars = dependency.get_link_variables()
+                    dep_link_vars_cache[dependency] = link_vars
+                dep_link_vars.update(link_vars)
             for container in service.containers:
-                # Containers always know about their peers in the same service.
+                # Containers always know about their peers in the same
+                # service, and get links from the service's dependencies.
                 container.env.update(service_link_vars)
-                # Containers also get links from the service's dependencies.
-                for dependency in service.requires.union(service.wants_info):
-                    dep_link_vars = dep_link_vars_cache.get(dependency, None)
-                    if dep_link_vars is None:
-                        dep_link_vars = dependency.get_link_variables()
-                        dep_link_vars_cache[dependency] = dep_link_vars
-                    container.env.update(dep_link_vars)
+                container.env.update(dep_link_vars)
 
         # Check for host locality and volume conflicts on volumes_from, and add
         # service dependencies implicitely required by volumes_from another
@@ -135,8 +159,56 @@ class Conductor:
                         .format(container.name, other.name,
                                 ', '.join(conflicts)))
 
-                # Add the dependency against the volumes_from's service.
-                container.service.add_dependency(other.service)
+                # Add the dependency against the volumes_from's service. A
+                # volumes_from within the same service must not create a
+                # self-dependency, which would make the transitive dependency
+                # closures recurse forever.
+                if other.service is not container.service:
+                    container.service.add_dependency(other.service)
+
+        # The dependency graph is complete; freeze each service's dependency
+        # sets so their transitive closures are computed once and every later
+        # query runs against cached frozensets.
+        for service in self.services.values():
+            service.freeze()
+
+        # Precompute each service's transitive dependency closure, in both
+        # directions, as a frozen set of containers. The service graph is
+        # immutable once built, so these are computed once and looked up by
+        # every orchestration command instead of re-traversing the graph.
+        self._fwd_closure = {}
+        self._rev_closure = {}
+        for service in self.services.values():
+            self._fwd_closure[service] = frozenset(
+                itertools.chain.from_iterable(
+                    dep.containers for dep in service.requires))
+            self._rev_closure[service] = frozenset(
+                itertools.chain.from_iterable(
+                    dep.containers for dep in service.needed_for))
+
+        # For small environments (at most 64 services, the typical case),
+        # additionally encode the closures as integer bitmasks so gathering
+        # dependencies boils down to OR-ing a few machine words.
+        self._use_bitmasks = len(self.services) <= 64
+        if self._use_bitmasks:
+            self._services_by_bit = list(self.services.values())
+            for index, service in enumerate(self._services_by_bit):
+                service._bit = 1 << index
+            for service in self._services_by_bit:
+                fwd_bits = 0
+                for dep in service.requires:
+                    fwd_bits |= dep._bit
+                rev_bits = 0
+                for dep in service.needed_for:
+                    rev_bits |= dep._bit
+                service._fwd_bits = fwd_bits
+                service._rev_bits = rev_bits
+
+        # Sorted completion candidates for shell auto-completion, split
+        # between command names and service/container names.
+        self._command_completions = tuple(sorted(AVAILABLE_MAESTRO_COMMANDS))
+        self._name_completions = tuple(sorted(itertools.chain(
+            self.services, self.containers)))
 
         # Instantiate audit bindings
         self.auditor = audit.AuditorFactory.from_config(
@@ -154,54 +226,96 @@ class Conductor:
     def env_name(self):
         return self._config['name']
 
-    def _order_dependencies(self, pending=None, ordered=None, forward=True):
+    def _dependency_graph(self, pending, forward=True):
+        """Build the dependency graph of the given containers, restricted to
+        the containers themselves, in the given direction.
+
+        Returns the in-degree (number of in-set dependencies) of each
+        container and the adjacency map from each container to its in-set
+        dependents."""
+        pending_set = set(pending)
+        closures = self._fwd_closure if forward else self._rev_closure
+        indegree = {}
+        dependents = collections.defaultdict(list)
+        for container in pending:
+            deps = closures[container.service] & pending_set
+            indegree[container] = len(deps)
+            for dep in deps:
+                dependents[dep].append(container)
+        return indegree, dependents
+
+    def _iter_topological(self, pending, forward=True):
+        """Yield the given containers in an order respecting the service
+        dependencies in the given direction, as they become ready.
+
+        A container is emitted as soon as all of its dependencies within the
+        pending set have been emitted (smallest sort key first among the
+        ready ones), so consumers can start acting on the first containers
+        before the complete order has been computed.
+        """
+        pending = list(pending)
+        indegree, dependents = self._dependency_graph(pending, forward)
+
+        # Kahn's algorithm: seed the ready queue with the containers that
+        # have no in-set dependencies and release dependents as their
+        # dependencies are emitted.
+        ready = [c for c in pending if indegree[c] == 0]
+        heapq.heapify(ready)
+        emitted = 0
+        while ready:
+            container = heapq.heappop(ready)
+            emitted += 1
+            yield container
+            for dependent in dependents[container]:
+                indegree[dependent] -= 1
+                if indegree[dependent] == 0:
+                    heapq.heappush(ready, dependent)
+
+        # Any container not emitted is part of an unresolvable dependency
+        # loop within the pending set.
+        if emitted < len(pending):
+            wait = [c for c in pending if indegree[c] > 0]
+            raise exceptions.DependencyException(
+                'Cannot resolve dependencies for containers {}!'.format(
+                    [c.name for c in wait]))
+
+    def _order_dependencies(self, pending=None, forward=True):
         """Order the given set of containers into an order respecting the
         service dependencies in the given direction.
 
         The list of containers to order should be passed in the pending
-        parameter. The ordered list will be returned by the function (the
-        ordered parameter is for internal recursion use only).
+        parameter; the ordered list is returned.
 
         The direction of the dependencies controls whether the ordering should
         be constructed for startup (dependencies first) or shutdown (dependents
         first).
         """
-        pending = pending or []
-        ordered = ordered or []
-        wait = []
-        for container in pending:
-            deps = self._gather_dependencies([container], forward)
-            if deps and not deps.issubset(set(ordered + [container])):
-                wait.append(container)
-            else:
-                ordered.append(container)
-
-        # If wait and pending are not empty and have the same length, it means
-        # we were not able to order any container from the pending list (they
-        # all went to the wait list). This means the dependency tree cannot be
-        # resolved and an error should be raised.
-        if wait and pending and len(wait) == len(pending):
-            raise exceptions.DependencyException(
-                'Cannot resolve dependencies for containers {}!'.format(
-                    map(lambda x: x.name, wait)))
-
-        # As long as 'wait' has elements, keep recursing to resolve
-        # dependencies. Otherwise, returned the ordered list, which should now
-        # be final.
-        return wait and self._order_dependencies(wait, ordered, forward) \
-            or ordered
+        pending = list(pending or [])
+        closures = self._fwd_closure if forward else self._rev_closure
+        # Common case: none of the services involved has any dependency in
+        # the requested direction, so any sorted order works and the
+        # graph-building pass can be skipped entirely.
+        if all(not closures[c.service] for c in pending):
+            return sorted(pending)
+        return list(self._iter_topological(pending, forward))
 
     def _gather_dependencies(self, containers, forward=True):
         """Transitively gather all containers from the dependencies or
         dependents (depending on the value of the forward parameter) services
         that the services the given containers are members of."""
-        result = set(containers or self.containers.values())
-        for container in result:
-            deps = container.service.requires if forward \
-                else container.service.needed_for
-            deps = functools.reduce(lambda x, y: x.union(y),
-                                    [s.containers for s in deps], set([]))
-            result = result.union(deps)
+        result = set(containers) if containers else set(self._all_containers)
+        if self._use_bitmasks:
+            mask = 0
+            for container in result:
+                mask |= container.service._fwd_bits if forward \
+                    else container.service._rev_bits
+            for service in self._services_by_bit:
+                if service._bit & mask:
+                    result.update(service.containers)
+            return result
+        closures = self._fwd_closure if forward else self._rev_closure
+        for container in list(result):
+            result.update(closures[container.service])
         return result
 
     def _to_containers(self, things, expand_services, container_filter,
@@ -219,38 +333,42 @@ class Conductor:
                  ship names
         """
         def parse_thing(s):
-            if s in self.containers:
-                return [self.containers[s]]
-            elif s in self.services:
-                if expand_services:
-                    return self.services[s].containers
+            entry = self._lookup.get(s)
+            if entry is None:
                 raise exceptions.OrchestrationException(
-                    '{} is a service but --expand-services was not specified'
-                    .format(s))
+                    '{} is neither a service nor a container!'.format(s))
+            kind, thing = entry
+            if kind == 'c':
+                return [thing]
+            if expand_services:
+                return thing.containers
             raise exceptions.OrchestrationException(
-                '{} is neither a service nor a container!'.format(s))
-        result = []
+                '{} is a service but --expand-services was not specified'
+                .format(s))
+        result = set()
         for thing in things:
-            result += parse_thing(thing)
+            result.update(parse_thing(thing))
+        # Compile each glob pattern once instead of re-translating it for
+        # every container fnmatch.fnmatch() is called on.
         if container_filter:
-            result = [c for c in set(result)
-                      if fnmatch.fnmatch(c.name, container_filter)]
+            matcher = re.compile(fnmatch.translate(container_filter)).match
+            result = {c for c in result if matcher(c.name)}
         if ship_filter:
-            result = [c for c in set(result)
-                      if fnmatch.fnmatch(c.ship.name, ship_filter)]
+            matcher = re.compile(fnmatch.translate(ship_filter)).match
+            result = {c for c in result if matcher(c.ship.name)}
         return sorted(result)
 
     def _to_services(self, things):
         """Transform a list of "things", container names or service names, to a
         list of Service objects with no duplicates."""
         def parse_thing(s):
-            if s in self.containers:
-                return self.containers[s].service
-            if s in self.services:
-                return self.services[s]
-            raise exceptions.OrchestrationException(
-                '{} is neither a service nor a container!'.format(s))
-        return sorted(set(map(parse_thing, things)))
+            entry = self._lookup.get(s)
+            if entry is None:
+                raise exceptions.OrchestrationException(
+                    '{} is neither a service nor a container!'.format(s))
+            kind, thing = entry
+            return thing.service if kind == 'c' else thing
+        return sorted({parse_thing(t) for t in things})
 
     def _ordered_containers(self, things, expand_services, forward=True):
         """Return the ordered list of containers from the list of names passed
@@ -281,8 +399,8 @@ class Conductor:
         for token in tokens:
             args += [x for x in token.split(' ') if not x.startswith('-')]
 
-        choices = AVAILABLE_MAESTRO_COMMANDS if len(args) <= 2 \
-            else self.services.keys() + self.containers.keys()
+        choices = self._command_completions if len(args) <= 2 \
+            else self._name_completions
         prefix = ''
 
         if len(args) == 2:
@@ -293,7 +411,15 @@ class Conductor:
         if len(args) > 2:
             prefix = args.pop()
 
-        print(' '.join(filter(lambda x: x.startswith(prefix), set(choices))))
+        # The candidate tuples are sorted, so all matches sit in a contiguous
+        # run starting at the prefix's insertion point.
+        start = bisect.bisect_left(choices, prefix)
+        matches = []
+        for choice in choices[start:]:
+            if not choice.startswith(prefix):
+                break
+            matches.append(choice)
+        print(' '.join(matches))
 
     def status(self, things, full=False, show_hosts=False,
                with_dependencies=False, concurrency=None, expand_services=True,
@@ -567,11 +693,20 @@ class Conductor:
                 'Now streaming logs for {}. New output will appear below.'
                 .format(container.name))
 
+            out = getattr(sys.stdout, 'buffer', sys.stdout)
             while True:
                 logs = container.ship.backend.attach(container.id, stream=True)
                 o.pending('\033[2K')
+                # Each chunk the attach stream yields is data that has
+                # already arrived on the socket, so write and flush it
+                # straight away: a slow-emitting container must show its
+                # output immediately, and a backlog dump still comes through
+                # in the large chunks the daemon sends it as.
                 for line in logs:
-                    print(line.rstrip())
+                    if not isinstance(line, bytes):
+                        line = line.encode('utf-8')
+                    out.write(line.rstrip() + b'\n')
+                    out.flush()
 
                 o.pending('{} has died, waiting for respawn...'
                           .format(container.name))
@@ -588,19 +723,27 @@ class Conductor:
             o.pending(
                 'Requesting logs for {}. This may take a while...'
                 .format(container.name))
-            logs = container.ship.backend.logs(
-                container.id, tail=n).decode('utf-8').splitlines()
+            logs = container.ship.backend.logs(container.id, tail=n)
 
             o.pending('\033[2K')
-            for line in logs:
-                print(line.rstrip())
+            # Write the log dump as-is in one buffered write instead of
+            # decoding, splitting and print()-ing line by line.
+            out = getattr(sys.stdout, 'buffer', sys.stdout)
+            out.write(logs)
+            if logs and not logs.endswith(b'\n'):
+                out.write(b'\n')
+            out.flush()
 
     def deptree(self, things, recursive, **kwargs):
         """Display the dependency tree of the given services."""
+        # Sort each service's direct dependencies once; the recursive tree
+        # walk can visit the same service many times.
+        sorted_deps = {s: tuple(sorted(s.dependencies))
+                       for s in self.services.values()}
 
         def treehelper(service, indent, shown):
-            deps = sorted(service.dependencies) if recursive \
-                else sorted(service.dependencies.difference(shown))
+            deps = sorted_deps[service] if recursive \
+                else tuple(d for d in sorted_deps[service] if d not in shown)
             shown.update(deps)
             for i, dep in enumerate(deps, 1):
                 last = i == len(deps)
@@ -612,6 +755,6 @@ class Conductor:
         services = self._to_services(things or sorted(self.services))
         for i, service in enumerate(services, 1):
             print(service.name)
-            treehelper(service, ' ', set([]))
+            treehelper(service, ' ', set())
             if i < len(services):
                 print()
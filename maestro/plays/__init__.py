@@ -5,7 +5,7 @@
 
 from __future__ import print_function
 
-import functools
+import itertools
 import sys
 import threading
 
@@ -170,9 +170,8 @@ class BaseOrchestrationPlay:
         for container in result:
             deps = container.service.requires if self._forward \
                 else container.service.needed_for
-            deps = functools.reduce(lambda x, y: x.union(y),
-                                    [s.containers for s in deps],
-                                    set([]))
+            deps = set(itertools.chain.from_iterable(
+                s.containers for s in deps))
             result = result.union(deps.intersection(containers))
 
         result.remove(container)
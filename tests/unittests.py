@@ -6,7 +6,9 @@
 # Unit tests for Maestro, Docker container orchestration utility.
 
 import os
+import shutil
 import six
+import tempfile
 import unittest
 import yaml
 
@@ -578,6 +580,57 @@ class ConductorTest(BaseConfigFileUsingTest):
         self.assertEqual(container_names, {'webapp-b', 'webapp1-b'})
 
 
+class ConductorOrderingTest(BaseConfigFileUsingTest):
+
+    def _get_conductor(self):
+        return maestro.Conductor(self._get_config('dependency_order'))
+
+    def _assert_before(self, ordered, first, second):
+        names = [container.name for container in ordered]
+        self.assertLess(names.index(first), names.index(second))
+
+    def test_start_order_puts_dependencies_first(self):
+        c = self._get_conductor()
+        ordered = c._ordered_containers(['lb'], True)
+        self.assertEqual(set([container.name for container in ordered]),
+                         {'db1', 'cache1', 'app1', 'app2', 'lb1'})
+        for app in ['app1', 'app2']:
+            self._assert_before(ordered, 'db1', app)
+            self._assert_before(ordered, 'cache1', app)
+            self._assert_before(ordered, app, 'lb1')
+
+    def test_stop_order_puts_dependents_first(self):
+        c = self._get_conductor()
+        ordered = c._ordered_containers(['db'], True, forward=False)
+        # cache has no dependency relationship with db, so it should not be
+        # pulled in when gathering db's dependents.
+        self.assertEqual(set([container.name for container in ordered]),
+                         {'db1', 'app1', 'app2', 'lb1'})
+        for app in ['app1', 'app2']:
+            self._assert_before(ordered, 'lb1', app)
+            self._assert_before(ordered, app, 'db1')
+
+    def test_subset_ordering(self):
+        c = self._get_conductor()
+        subset = [c.containers[name] for name in ['lb1', 'app2', 'db1']]
+        ordered = c._order_dependencies(subset)
+        self.assertEqual([container.name for container in ordered],
+                         ['db1', 'app2', 'lb1'])
+
+    def test_cycle_raises_dependency_exception(self):
+        c = self._get_conductor()
+        db1 = c.containers['db1']
+        lb1 = c.containers['lb1']
+        # The description schema cannot express a dependency loop, so force
+        # one into the precomputed closures to exercise the cycle detection.
+        c._fwd_closure[db1.service] = frozenset([lb1])
+        c._fwd_closure[lb1.service] = frozenset([db1])
+        six.assertRaisesRegex(
+            self, exceptions.DependencyException,
+            'Cannot resolve dependencies',
+            lambda: c._order_dependencies([db1, lb1]))
+
+
 class ConfigTest(BaseConfigFileUsingTest):
 
     def test_base_dir_gets_set_by_loader(self):
@@ -603,6 +656,50 @@ class ConfigTest(BaseConfigFileUsingTest):
         self.assertTrue('1234' in c.ships['ship2'].backend.base_url)
 
 
+class CompiledConfigTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.config_file = os.path.join(self.tempdir, 'env.yaml')
+        shutil.copy(os.path.join(os.path.dirname(__file__),
+                                 'yaml/empty_registries.yaml'),
+                    self.config_file)
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_compile_roundtrip(self):
+        parsed = loader.load(self.config_file)
+        compiled = loader.compile_config(self.config_file)
+        self.assertTrue(compiled.endswith('.maestro-compiled.py'))
+        self.assertEqual(parsed, loader.load_compiled(compiled))
+
+    def test_load_uses_fresh_compiled_config(self):
+        compiled = loader.compile_config(self.config_file)
+        config = loader.load_compiled(compiled)
+        config['name'] = 'from-compiled'
+        loader.dump_compiled(config, compiled)
+        self.assertEqual('from-compiled',
+                         loader.load(self.config_file)['name'])
+
+    def test_load_ignores_stray_python_sibling(self):
+        with open(os.path.join(self.tempdir, 'env.py'), 'w') as f:
+            f.write('raise RuntimeError("must never be executed")\n')
+        config = loader.load(self.config_file)
+        self.assertEqual('test-empty-registries', config['name'])
+
+    def test_load_falls_back_on_broken_compiled_config(self):
+        compiled = loader.compile_config(self.config_file)
+        with open(compiled, 'w') as f:
+            f.write('raise ValueError("broken compiled config")\n')
+        config = loader.load(self.config_file)
+        self.assertEqual('test-empty-registries', config['name'])
+
+    def test_cannot_compile_from_stdin(self):
+        self.assertRaises(exceptions.MaestroException,
+                          lambda: loader.compile_config('-'))
+
+
 class AuditorConfigTest(BaseConfigFileUsingTest):
 
     def test_ignore_errors_wraps_with_non_failing_auditor(self):